@@ -0,0 +1,55 @@
+"""Export rf_model.joblib to the packed forest served by main.py.
+
+Run once after retraining the model:
+
+    python convert_model.py
+
+This writes rf_model_packed.npz next to the joblib model; main.py falls back to
+the joblib model when the packed export is missing. The export is refused if
+the packed forest disagrees with rf_model.predict on any probe row.
+"""
+import os
+import warnings
+
+import joblib
+import numpy as np
+
+from packed_forest import PackedForest, pack_forest
+
+PARITY_PROBE_ROWS = 20000
+
+def probe_rows(arrays, n_features: int, n_rows: int, seed: int = 0) -> np.ndarray:
+    """Sample float32 rows whose values sit on and just above the split thresholds."""
+    rng = np.random.default_rng(seed)
+    columns = []
+    for index in range(n_features):
+        thresholds = arrays["threshold"][arrays["feature"] == index]
+        values = np.concatenate([
+            thresholds,
+            np.nextafter(thresholds, np.float32(np.inf)),
+            np.zeros(1, dtype=np.float32)
+        ])
+        columns.append(rng.choice(values, size=n_rows))
+    return np.stack(columns, axis=1).astype(np.float32)
+
+def check_parity(rf_model, arrays) -> None:
+    """Raise if the packed forest and sklearn disagree on any probe row."""
+    X = probe_rows(arrays, rf_model.n_features_in_, PARITY_PROBE_ROWS)
+    with warnings.catch_warnings():
+        # The model may have been fit on a DataFrame; probes are plain arrays
+        warnings.simplefilter("ignore", UserWarning)
+        expected = rf_model.predict(X)
+    actual = PackedForest(arrays).predict(X)
+    mismatches = int(np.count_nonzero(actual != expected.astype(actual.dtype)))
+    if mismatches:
+        raise RuntimeError(f"Packed forest disagrees with rf_model.predict on {mismatches} of {len(X)} probe rows")
+
+def main():
+    base_dir = os.path.dirname(__file__)
+    rf_model = joblib.load(os.path.join(base_dir, 'rf_model.joblib'))
+    arrays = pack_forest(rf_model)
+    check_parity(rf_model, arrays)
+    np.savez(os.path.join(base_dir, 'rf_model_packed.npz'), **arrays)
+
+if __name__ == "__main__":
+    main()
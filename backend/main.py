@@ -1,22 +1,38 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+import anyio
 from pydantic import BaseModel, validator
 import httpx
+import aiohttp
 import os
 from dotenv import load_dotenv
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from functools import lru_cache
+from urllib.parse import urlsplit
 from json.decoder import JSONDecodeError
 import json
+import orjson
 import asyncio
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import logging
+from contextlib import asynccontextmanager
+from aiobreaker import CircuitBreaker, CircuitBreakerError
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception
 import re
-import pandas as pd
+import numpy as np
 import joblib
-from datetime import datetime, timedelta
+import packed_forest
+import hashlib
+from datetime import timedelta
+from cachetools import TTLCache
 
 # Load environment variables
 load_dotenv()
 
+# uvicorn's --log-level only covers the uvicorn.* loggers; configure this one
+# through --log-config (or logging.basicConfig when run directly)
+logger = logging.getLogger("sentinel")
+
 # API Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME")
@@ -25,10 +41,38 @@ TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 
 # Constants
 MAX_CHUNK_SIZE = 400  # Further reduced chunk size for faster processing
+MIN_CHUNK_SIZE = 100  # Smaller chunks borrow pieces from the chunk before them
 DEFAULT_TIMEOUT = 30.0
 MAX_TIMEOUT = 55.0  # Maximum allowed timeout
+# Server-side bound on each LLM attempt; the client's timeout only bounds the
+# overall fan-out so a short client budget can't trip the circuit breaker
+LLM_REQUEST_TIMEOUT = MAX_TIMEOUT
 MAX_RETRIES = 3
+MAX_RETRY_WAIT = 30.0  # Upper bound for the jittered backoff between retries
+BREAKER_FAIL_MAX = 5  # Consecutive upstream failures before a breaker opens
+BREAKER_RESET_TIMEOUT = timedelta(seconds=30)  # How long a breaker stays open
 DELAY_BETWEEN_CHUNKS = 0.5  # Reduced delay
+LLM_MAX_CONNECTIONS = 64
+LLM_KEEPALIVE_TIMEOUT = 60
+TAVILY_MAX_CONNECTIONS = 16
+TAVILY_MAX_KEEPALIVE_CONNECTIONS = 8
+# Chunks analyzed at once per request, sized so every attempt fits in the LLM pool
+CHUNK_CONCURRENCY = min(8, LLM_MAX_CONNECTIONS // (MAX_RETRIES + 1))
+THREADPOOL_SIZE = 100  # Worker threads for CPU-bound work moved off the event loop
+UPLOAD_RATE_LIMIT_SECONDS = 60  # One traffic upload per client in this window
+UPLOAD_HISTORY_SIZE = 10000
+ANALYZE_CACHE_SIZE = 1024
+ANALYZE_CACHE_TTL = 3600  # Seconds an /api/analyze result is reused
+TAVILY_CACHE_SIZE = 2048
+TAVILY_CACHE_TTL = 900  # Seconds a Tavily search result is reused
+MAX_TRAFFIC_FILE_SIZE = 2 * 1024 * 1024  # Enough for a full batch of rows
+MAX_TRAFFIC_BATCH_ROWS = 10000
+
+# Per-upstream timeouts in seconds; each upstream has its own pool (bulkhead)
+HTTP_TIMEOUTS = {
+    "llm": {"connect": 3.0, "read": DEFAULT_TIMEOUT, "write": 5.0, "pool": 2.0},
+    "tavily": {"connect": 3.0, "read": DEFAULT_TIMEOUT, "write": 5.0, "pool": 2.0}
+}
 
 # Additional headers for API requests
 API_HEADERS = {
@@ -39,7 +83,79 @@ API_HEADERS = {
     "Connection": "keep-alive"
 }
 
-app = FastAPI()
+# Constant parts of every chat completion request
+CHAT_COMPLETIONS_URL = f"{API_BASE_URL}/chat/completions"
+CHAT_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a compliance expert. Analyze the technical process and identify key regulations. Be concise and focused."
+}
+CHAT_BASE_BODY = {
+    "model": OPENAI_MODEL_NAME,
+    "temperature": 0.3,
+    "max_tokens": 400  # Reduced token limit
+}
+
+def create_tavily_client() -> httpx.AsyncClient:
+    """Build the pooled HTTP/2 client used for Tavily searches."""
+    timeouts = HTTP_TIMEOUTS["tavily"]
+    # httpx ignores client-level http2/limits when a transport is given, so they live here
+    transport = httpx.AsyncHTTPTransport(
+        retries=3,
+        http2=True,
+        limits=httpx.Limits(
+            max_keepalive_connections=TAVILY_MAX_KEEPALIVE_CONNECTIONS,
+            max_connections=TAVILY_MAX_CONNECTIONS
+        )
+    )
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            connect=timeouts["connect"],
+            read=timeouts["read"],
+            write=timeouts["write"],
+            pool=timeouts["pool"]
+        ),
+        transport=transport
+    )
+
+def llm_timeout(total: float) -> aiohttp.ClientTimeout:
+    """Build an LLM request timeout bounded by total seconds."""
+    timeouts = HTTP_TIMEOUTS["llm"]
+    # aiohttp has no write timeout; its connect timeout includes waiting for the pool
+    return aiohttp.ClientTimeout(
+        total=total,
+        connect=timeouts["pool"] + timeouts["connect"],
+        sock_connect=timeouts["connect"],
+        sock_read=timeouts["read"]
+    )
+
+def create_llm_session() -> aiohttp.ClientSession:
+    """Build the aiohttp session used for the concurrent LLM fan-out."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=LLM_MAX_CONNECTIONS,
+            limit_per_host=LLM_MAX_CONNECTIONS,
+            keepalive_timeout=LLM_KEEPALIVE_TIMEOUT
+        ),
+        timeout=llm_timeout(LLM_REQUEST_TIMEOUT)
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep one client per upstream for the lifetime of the app so
+    # pooled connections are reused between requests
+    app.state.llm_session = create_llm_session()
+    app.state.tavily_client = create_tavily_client()
+    # Size the shared worker threadpool used by run_in_threadpool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # Warm up the model so the first request doesn't pay for paging it in
+    predict_traffic(np.zeros((1, len(TRAFFIC_FEATURES)), dtype=np.float32))
+    try:
+        yield
+    finally:
+        await app.state.llm_session.close()
+        await app.state.tavily_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -51,12 +167,75 @@ app.add_middleware(
     max_age=3600,
 )
 
-# Load the model
+# Feature order the model was trained on
+TRAFFIC_FEATURES = ['sbytes', 'rate', 'sttl', 'dttl', 'sload', 'dload', 'smean', 'ct_state_ttl', 'ct_dst_src_ltm', 'ct_srv_dst']
+
+# Load the model, preferring the packed export from convert_model.py when present
 model_path = os.path.join(os.path.dirname(__file__), 'rf_model.joblib')
-rf_model = joblib.load(model_path)
+packed_model_path = os.path.join(os.path.dirname(__file__), 'rf_model_packed.npz')
+rf_model = None
+rf_packed = None
+
+if os.path.exists(packed_model_path):
+    rf_packed = packed_forest.load_packed_forest(packed_model_path)
+
+    # Catch exports from a model with a different feature order or width, or a
+    # stale export left behind after retraining on other features
+    if rf_packed.n_features != len(TRAFFIC_FEATURES) or (
+            rf_packed.feature_names is not None and rf_packed.feature_names != TRAFFIC_FEATURES):
+        raise RuntimeError("Packed model features do not match the expected traffic features; re-run convert_model.py")
+else:
+    rf_model = joblib.load(model_path)
+
+    # The model was fit on a DataFrame; once the column order is confirmed, drop the
+    # stored feature names so it can be fed plain arrays without name validation
+    if hasattr(rf_model, "feature_names_in_"):
+        if list(rf_model.feature_names_in_) != TRAFFIC_FEATURES:
+            raise RuntimeError("Model features do not match the expected traffic features")
+        del rf_model.feature_names_in_
+
+def predict_traffic(X: np.ndarray) -> np.ndarray:
+    """Predict traffic classes for a float32 array of shape (n_rows, n_features)."""
+    if rf_packed is not None:
+        return rf_packed.predict(X)
+    return rf_model.predict(X)
+
+# Response caches keyed by a hash of the request content
+analyze_cache = TTLCache(maxsize=ANALYZE_CACHE_SIZE, ttl=ANALYZE_CACHE_TTL)
+tavily_cache = TTLCache(maxsize=TAVILY_CACHE_SIZE, ttl=TAVILY_CACHE_TTL)
+
+# Upstream calls currently in flight, so identical concurrent requests share one call
+inflight_calls: Dict[bytes, "InflightCall"] = {}
+
+# Precompiled patterns used by the text splitter
+_INLINE_WS_RE = re.compile(r'[^\S\n]+')
+_LINE_WS_RE = re.compile(r' ?\n ?')
+_PARAGRAPH_RE = re.compile(r'\n{3,}')
+
+# Precompiled detectors used when parsing the LLM analysis
+_REG_RE = re.compile(r'GDPR|CCPA|HIPAA|PCI DSS|SOC 2|ISO')
+_TECH_HDR_RE = re.compile(r'Technical (?:Requirements|Implementation):')
+_STEPS_HDR_RE = re.compile(r'(?:Next|Recommended) Steps:')
+_PRIO_HIGH_RE = re.compile(r'critical|high priority|urgent|immediate', re.I)
+_PRIO_MED_RE = re.compile(r'moderate|medium priority|important', re.I)
+
+# Markers of a Cloudflare challenge page, matched without lowercasing the body
+_CLOUDFLARE_RE = re.compile(
+    r'attention required! \| cloudflare|please turn javascript on|please enable cookies|ray id:|cdn-cgi',
+    re.I
+)
 
-# Store upload timestamps for rate limiting (in-memory for local development)
-upload_history = {}
+# Domain labels used to categorize policy search results
+_GOV_LABELS = frozenset({"gov", "govt", "government"})
+_INTL_LABELS = frozenset({"int"})
+_INTL_DOMAINS = frozenset({"un.org"})
+
+# Separators tried in order when splitting oversized text
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", "? ", "! ", "; ", " "]
+
+# Recent uploaders for rate limiting (in-memory for local development); entries
+# expire on their own once the rate-limit window has passed
+upload_history = TTLCache(maxsize=UPLOAD_HISTORY_SIZE, ttl=UPLOAD_RATE_LIMIT_SECONDS)
 
 class AnalyzeRequest(BaseModel):
     technicalProcess: str
@@ -91,121 +270,241 @@ class SentinelResponse(BaseModel):
 
 def is_cloudflare_challenge(response_text: str) -> bool:
     """Check if the response is a Cloudflare challenge page."""
-    return any(indicator in response_text.lower() for indicator in [
-        "attention required! | cloudflare",
-        "please turn javascript on",
-        "please enable cookies",
-        "ray id:",
-        "cdn-cgi"
-    ])
+    return _CLOUDFLARE_RE.search(response_text) is not None
 
 def should_retry_error(exception: Exception) -> bool:
     """Determine if we should retry based on the exception."""
     if isinstance(exception, HTTPException):
-        return exception.status_code in [429, 503, 502, 500]
-    if isinstance(exception, httpx.HTTPError):
+        return exception.status_code in [429, 504, 503, 502, 500]
+    if isinstance(exception, (aiohttp.ClientError, asyncio.TimeoutError)):
         return True
     return False
 
-def split_into_chunks(text: str, max_length: int = MAX_CHUNK_SIZE) -> List[str]:
-    """Split text into chunks at logical boundaries."""
-    # Clean and normalize the text
-    text = text.replace('\n', ' ').strip()
+def is_upstream_failure(exception: Exception) -> bool:
+    """Determine if an exception means the upstream service itself is failing."""
+    return should_retry_error(exception) or isinstance(exception, httpx.HTTPError)
+
+# Separate breakers so an LLM outage doesn't take policy search down with it
+# (and vice versa); client errors such as 400/401 don't count as failures
+llm_breaker = CircuitBreaker(
+    fail_max=BREAKER_FAIL_MAX,
+    timeout_duration=BREAKER_RESET_TIMEOUT,
+    exclude=[lambda e: not is_upstream_failure(e)],
+    name="llm"
+)
+tavily_breaker = CircuitBreaker(
+    fail_max=BREAKER_FAIL_MAX,
+    timeout_duration=BREAKER_RESET_TIMEOUT,
+    exclude=[lambda e: not is_upstream_failure(e)],
+    name="tavily"
+)
+
+def make_cache_key(namespace: str, *parts: Optional[str]) -> bytes:
+    """Hash request content into a compact cache key.
     
-    # Split by common delimiters
-    delimiters = r'(?<=[.!?])\s+|\.\s+|\?\s+|\!\s+|;\s+|\n+|\. |\? |\! '
-    sentences = re.split(delimiters, text)
-    sentences = [s.strip() for s in sentences if s.strip()]
+    The namespace keeps endpoints that share inflight_calls apart, and each part
+    is length-prefixed so different part lists never hash the same bytes.
+    """
+    digest = hashlib.blake2b(digest_size=16, person=namespace.encode())
+    for part in parts:
+        encoded = (part or "").encode()
+        digest.update(len(encoded).to_bytes(8, "little"))
+        digest.update(encoded)
+    return digest.digest()
+
+_MISSING = object()  # Cache miss sentinel, since None is a valid result
+
+class InflightCall:
+    """An upstream call shared by every request currently waiting on it."""
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+async def cached_call(
+    cache: TTLCache,
+    key: bytes,
+    compute: Callable[[], Awaitable[Any]],
+    cacheable: Callable[[Any], bool] = lambda result: True,
+    inflight_key: Optional[bytes] = None
+) -> Any:
+    """Return the cached result for key, computing it at most once at a time.
     
-    chunks = []
-    current_chunk = []
-    current_length = 0
+    Results rejected by cacheable are returned but not stored. Concurrent
+    requests share one call when their inflight_key (key by default) matches,
+    so inputs that change the outcome but not a complete result, like a
+    deadline, can be left out of the cache key. The shared call keeps running
+    while any request still waits on it and is cancelled once the last one
+    leaves (e.g. every client disconnected).
+    """
+    # Single lookup: TTLCache can expire the key between a membership test and a read
+    cached = cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
     
-    for sentence in sentences:
-        sentence_length = len(sentence)
+    # Coalesce concurrent identical requests into a single upstream call
+    if inflight_key is None:
+        inflight_key = key
+    call = inflight_calls.get(inflight_key)
+    if call is None:
+        call = InflightCall(asyncio.ensure_future(compute()))
+        inflight_calls[inflight_key] = call
         
-        # If a single sentence is too long, split it further
-        if sentence_length > max_length:
-            words = sentence.split()
-            temp_chunk = []
-            temp_length = 0
-            
-            for word in words:
-                word_length = len(word) + 1  # +1 for space
-                if temp_length + word_length > max_length:
-                    if temp_chunk:
-                        chunks.append(' '.join(temp_chunk) + '.')
-                    temp_chunk = [word]
-                    temp_length = word_length
-                else:
-                    temp_chunk.append(word)
-                    temp_length += word_length
-            
-            if temp_chunk:
-                chunks.append(' '.join(temp_chunk) + '.')
-            continue
+        def finish(task: "asyncio.Task[Any]") -> None:
+            if inflight_calls.get(inflight_key) is call:
+                del inflight_calls[inflight_key]
+            # Cache from the task itself so the result is kept even if its starter left
+            if not task.cancelled() and task.exception() is None and cacheable(task.result()):
+                cache[key] = task.result()
         
-        # For normal sentences
-        if current_length + sentence_length > max_length:
-            if current_chunk:
-                chunks.append(' '.join(current_chunk) + '.')
-            current_chunk = [sentence]
-            current_length = sentence_length
+        call.task.add_done_callback(finish)
+    
+    call.waiters += 1
+    try:
+        return await asyncio.shield(call.task)
+    finally:
+        call.waiters -= 1
+        if call.waiters == 0 and not call.task.done():
+            # Drop the entry now so no new request joins a call that is being cancelled
+            if inflight_calls.get(inflight_key) is call:
+                del inflight_calls[inflight_key]
+            call.task.cancel()
+
+def _normalize_text(text: str) -> str:
+    """Collapse runs of whitespace while keeping line and paragraph breaks."""
+    text = _INLINE_WS_RE.sub(' ', text)
+    text = _LINE_WS_RE.sub('\n', text)
+    text = _PARAGRAPH_RE.sub('\n\n', text)
+    return text.strip()
+
+def _split_recursive(text: str, max_length: int, separators: List[str]) -> List[str]:
+    """Split text down the separator list until every piece fits in max_length."""
+    if len(text) <= max_length:
+        return [text]
+    
+    for i, separator in enumerate(separators):
+        if separator in text:
+            break
+    else:
+        # No separator left, fall back to a hard cut
+        return [text[i:i + max_length] for i in range(0, len(text), max_length)]
+    
+    pieces = []
+    parts = text.split(separator)
+    for j, part in enumerate(parts):
+        # Keep sentence punctuation attached to the piece it ends
+        if j < len(parts) - 1:
+            part += separator.rstrip()
+        part = part.strip()
+        if not part:
+            continue
+        if len(part) > max_length:
+            pieces.extend(_split_recursive(part, max_length, separators[i + 1:]))
         else:
-            current_chunk.append(sentence)
-            current_length += sentence_length
+            pieces.append(part)
+    return pieces
+
+def _chunk_length(pieces: List[str]) -> int:
+    """Length of the chunk formed by joining pieces with single spaces."""
+    return sum(len(piece) for piece in pieces) + len(pieces) - 1
+
+def _rebalance_tiny_chunks(groups: List[List[str]], max_length: int, min_length: int) -> List[List[str]]:
+    """Grow chunks shorter than min_length with trailing pieces of the chunk before them.
+    
+    The greedy merge already packs pieces as tightly as max_length allows, so a
+    short chunk can't be folded into a neighbour. Instead pieces move back from
+    its predecessor as long as both chunks stay within max_length and the
+    predecessor doesn't itself drop below min_length.
+    """
+    for previous, current in zip(groups, groups[1:]):
+        while _chunk_length(current) < min_length and len(previous) > 1:
+            piece = previous[-1]
+            if _chunk_length(current) + len(piece) + 1 > max_length \
+                    or _chunk_length(previous) - len(piece) - 1 < min_length:
+                break
+            current.insert(0, previous.pop())
+    return groups
+
+def split_into_chunks(
+    text: str,
+    max_length: int = MAX_CHUNK_SIZE,
+    min_length: int = MIN_CHUNK_SIZE
+) -> List[str]:
+    """Split text into chunks of at most max_length at logical boundaries.
     
-    # Add the last chunk
-    if current_chunk:
-        chunks.append(' '.join(current_chunk) + '.')
+    Oversized text is split recursively down CHUNK_SEPARATORS, then adjacent
+    pieces are greedily merged back up to max_length so that as few chunks as
+    possible are sent to the LLM. Chunks shorter than min_length then borrow
+    pieces from the chunk before them where that fits.
+    """
+    text = _normalize_text(text)
+    if not text:
+        return []
     
-    return chunks
+    # Pass 1: split until every piece fits
+    pieces = _split_recursive(text, max_length, CHUNK_SEPARATORS)
+    
+    # Pass 2: greedily merge adjacent pieces
+    groups = []
+    current_group = []
+    for piece in pieces:
+        if current_group and _chunk_length(current_group) + len(piece) + 1 <= max_length:
+            current_group.append(piece)
+        else:
+            if current_group:
+                groups.append(current_group)
+            current_group = [piece]
+    if current_group:
+        groups.append(current_group)
+    
+    # Pass 3: give tiny fragments some surrounding context
+    groups = _rebalance_tiny_chunks(groups, max_length, min_length)
+    return [' '.join(group) for group in groups]
 
 @retry(
     stop=stop_after_attempt(MAX_RETRIES),
-    wait=wait_exponential(multiplier=1, min=2, max=4),
-    retry=retry_if_exception_type((httpx.HTTPError, HTTPException))
+    wait=wait_random_exponential(multiplier=1, max=MAX_RETRY_WAIT),
+    retry=retry_if_exception(should_retry_error),
+    reraise=True
 )
-async def make_api_request(client: httpx.AsyncClient, url: str, method: str, headers: Dict[str, str], json_data: Dict[str, Any]) -> httpx.Response:
+@llm_breaker
+async def make_api_request(session: aiohttp.ClientSession, url: str, method: str, headers: Dict[str, str], payload: bytes) -> Dict[str, Any]:
     try:
         request_headers = {**API_HEADERS, **headers}
-        response = await client.request(
+        async with session.request(
             method,
             url,
             headers=request_headers,
-            json=json_data,
-            timeout=REQUEST_TIMEOUT,
-            follow_redirects=True
-        )
-        
-        if response.status_code in [403, 503] and is_cloudflare_challenge(response.text):
-            raise HTTPException(
-                status_code=503,
-                detail="API access is temporarily restricted. Please try again in a few minutes."
-            )
-            
-        response.raise_for_status()
-        return response
-    except httpx.TimeoutException:
+            data=payload
+        ) as response:
+            if response.status >= 400:
+                # Only read the body as text when we need to inspect the error
+                response_text = await response.text()
+                if response.status in [403, 503] and is_cloudflare_challenge(response_text):
+                    raise HTTPException(
+                        status_code=503,
+                        detail="API access is temporarily restricted. Please try again in a few minutes."
+                    )
+                raise HTTPException(
+                    status_code=response.status,
+                    detail=handle_http_error(response_text)
+                )
+
+            return orjson.loads(await response.read())
+    except asyncio.TimeoutError:
         raise HTTPException(
             status_code=504,
             detail="Request timed out. The system is processing a high volume of requests."
         )
-    except httpx.HTTPStatusError as e:
-        error_detail = handle_http_error(e)
-        raise HTTPException(
-            status_code=e.response.status_code,
-            detail=error_detail
-        )
-    except httpx.RequestError:
+    except aiohttp.ClientError:
         raise HTTPException(
             status_code=503,
             detail="Service temporarily unavailable. Please try again later."
         )
 
-def handle_http_error(e: httpx.HTTPStatusError) -> str:
+def handle_http_error(response_text: str) -> str:
     try:
-        error_response = e.response.json()
+        error_response = json.loads(response_text)
         if isinstance(error_response, dict):
             if "error" in error_response and isinstance(error_response["error"], dict):
                 error_msg = error_response["error"].get("message", "Unknown error")
@@ -216,20 +515,17 @@ def handle_http_error(e: httpx.HTTPStatusError) -> str:
                     )
                 return f"API Error: {error_msg}"
     except JSONDecodeError:
-        if is_cloudflare_challenge(e.response.text):
+        if is_cloudflare_challenge(response_text):
             return "API access is temporarily restricted. Please try again in a few minutes."
     return "The API service is currently unavailable. Please try again later."
 
 async def process_chunk(
-    client: httpx.AsyncClient,
+    session: aiohttp.ClientSession,
     chunk: str,
     chunk_index: int,
-    total_chunks: int,
-    timeout: float
+    total_chunks: int
 ) -> Dict[str, Any]:
-    """Process a single chunk of text with timeout."""
-    system_prompt = """You are a compliance expert. Analyze the technical process and identify key regulations. Be concise and focused."""
-
+    """Process a single chunk of text."""
     context = f"Part {chunk_index + 1}/{total_chunks}"
     
     user_prompt = f"""Analyze this process segment for compliance requirements:
@@ -242,34 +538,107 @@ Provide brief:
 3. Next steps"""
 
     try:
-        openai_response = await make_api_request(
-            client,
-            f"{API_BASE_URL}/chat/completions",
+        payload = orjson.dumps({
+            **CHAT_BASE_BODY,
+            "messages": [CHAT_SYSTEM_MESSAGE, {"role": "user", "content": user_prompt}],
+            "timeout": LLM_REQUEST_TIMEOUT
+        })
+        openai_data = await make_api_request(
+            session,
+            CHAT_COMPLETIONS_URL,
             "POST",
             headers={},
-            json_data={
-                "model": OPENAI_MODEL_NAME,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "temperature": 0.3,
-                "max_tokens": 400,  # Reduced token limit
-                "timeout": timeout
-            }
+            payload=payload
         )
         
-        openai_data = openai_response.json()
         return {
             "chunk_index": chunk_index,
             "analysis": openai_data["choices"][0]["message"]["content"]
         }
-    except Exception as e:
-        print(f"Error processing chunk {chunk_index + 1}: {str(e)}")
+    except HTTPException as e:
+        # Upstream rejections are expected; a traceback adds nothing
+        logger.warning("Error processing chunk %d: %d %s", chunk_index + 1, e.status_code, e.detail)
+        raise
+    except CircuitBreakerError:
+        logger.warning("Skipping chunk %d: LLM circuit breaker is open", chunk_index + 1)
+        raise
+    except Exception:
+        logger.exception("Error processing chunk %d", chunk_index + 1)
         raise
 
+async def run_compliance_analysis(
+    session: aiohttp.ClientSession,
+    technical_process: str,
+    timeout: float
+) -> Dict[str, Any]:
+    """Chunk the technical process, analyze every chunk and parse the combined result."""
+    # Split into smaller chunks (whitespace is normalized by the splitter)
+    process_chunks = await run_in_threadpool(split_into_chunks, technical_process, MAX_CHUNK_SIZE)
+    if not process_chunks:
+        raise HTTPException(
+            status_code=400,
+            detail="Technical process description is empty."
+        )
+
+    # Only send each distinct chunk once; repeated boilerplate reuses the result
+    unique_chunks = list(dict.fromkeys(process_chunks))
+    index_map = {chunk: i for i, chunk in enumerate(unique_chunks)}
+    total_chunks = len(unique_chunks)
+    
+    # Process chunks concurrently with semaphore to control concurrency
+    sem = asyncio.Semaphore(CHUNK_CONCURRENCY)  # Limit concurrent processing
+    
+    async def process_with_semaphore(chunk, index):
+        async with sem:
+            return await process_chunk(session, chunk, index, total_chunks)
+    
+    tasks = [
+        asyncio.ensure_future(process_with_semaphore(chunk, i))
+        for i, chunk in enumerate(unique_chunks)
+    ]
+    
+    # The request timeout bounds the whole fan-out; stragglers are cancelled
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=timeout)
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    unique_analyses = {}
+    errors = []
+    for task in done:
+        if task.exception() is not None:
+            errors.append(task.exception())
+        else:
+            result = task.result()
+            unique_analyses[result["chunk_index"]] = result["analysis"]
+    
+    if not unique_analyses:
+        if errors:
+            raise errors[0]
+        raise HTTPException(
+            status_code=504,
+            detail="Analysis took too long. Please break down your description into smaller, more focused parts."
+        )
+    
+    # Fan results back out to every position, skipping chunks that didn't finish
+    all_analyses = [
+        unique_analyses[index_map[chunk]]
+        for chunk in process_chunks
+        if index_map[chunk] in unique_analyses
+    ]
+
+    # Combine and parse results
+    combined_analysis = "\n\n".join(all_analyses)
+    parsed_response = await run_in_threadpool(parse_compliance_analysis, combined_analysis)
+    
+    return {
+        "summary": parsed_response,
+        "partial": len(unique_analyses) < total_chunks
+    }
+
 @app.post("/api/analyze")
-async def analyze_compliance(request: AnalyzeRequest):
+async def analyze_compliance(request: AnalyzeRequest, http_request: Request):
     if not all([OPENAI_API_KEY, OPENAI_MODEL_NAME]):
         raise HTTPException(
             status_code=500,
@@ -282,69 +651,27 @@ async def analyze_compliance(request: AnalyzeRequest):
             detail="Technical process description is too long. Please limit to 4000 characters."
         )
 
-    try:
-        transport = httpx.AsyncHTTPTransport(retries=3)
-        limits = httpx.Limits(max_keepalive_connections=5, max_connections=10)
-        
-        async with httpx.AsyncClient(
-            timeout=request.timeout,
-            transport=transport,
-            limits=limits,
-            http2=True
-        ) as client:
-            # Optimize text before chunking
-            text = request.technicalProcess.replace('\n', ' ').strip()
-            text = re.sub(r'\s+', ' ', text)  # Remove extra whitespace
-            
-            # Split into smaller chunks
-            process_chunks = split_into_chunks(text, MAX_CHUNK_SIZE)
-            total_chunks = len(process_chunks)
-            
-            if total_chunks > 1:
-                # Process chunks concurrently with semaphore to control concurrency
-                sem = asyncio.Semaphore(3)  # Limit concurrent processing
-                
-                async def process_with_semaphore(chunk, index):
-                    async with sem:
-                        return await process_chunk(client, chunk, index, total_chunks, request.timeout)
-                
-                tasks = [
-                    process_with_semaphore(chunk, i)
-                    for i, chunk in enumerate(process_chunks)
-                ]
-                
-                # Gather results with timeout
-                try:
-                    chunk_results = await asyncio.gather(*tasks)
-                    chunk_results.sort(key=lambda x: x["chunk_index"])
-                    all_analyses = [result["analysis"] for result in chunk_results]
-                except asyncio.TimeoutError:
-                    raise HTTPException(
-                        status_code=504,
-                        detail="Analysis took too long. Please break down your description into smaller, more focused parts."
-                    )
-            else:
-                # Single chunk processing
-                result = await process_chunk(client, process_chunks[0], 0, 1, request.timeout)
-                all_analyses = [result["analysis"]]
-
-            if not all_analyses:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Failed to analyze the technical process. Please try again."
-                )
+    session = http_request.app.state.llm_session
 
-            # Combine and parse results
-            combined_analysis = "\n\n".join(all_analyses)
-            parsed_response = parse_compliance_analysis(combined_analysis)
-            
-            return {
-                "summary": parsed_response
-            }
+    try:
+        key = make_cache_key("analyze", OPENAI_MODEL_NAME, request.technicalProcess)
+        return await cached_call(
+            analyze_cache,
+            key,
+            lambda: run_compliance_analysis(session, request.technicalProcess, request.timeout),
+            cacheable=lambda result: not result["partial"],
+            # A caller must not inherit the 504 or partial result of a shorter deadline
+            inflight_key=make_cache_key("analyze", OPENAI_MODEL_NAME, request.technicalProcess, repr(request.timeout))
+        )
 
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
+        if isinstance(e, CircuitBreakerError):
+            raise HTTPException(
+                status_code=503,
+                detail="LLM temporarily unavailable. Please try again later."
+            )
         if isinstance(e, asyncio.TimeoutError):
             raise HTTPException(
                 status_code=504,
@@ -364,58 +691,54 @@ def parse_compliance_analysis(analysis: str) -> Dict[str, Any]:
         "nextSteps": []
     }
     
-    # Split the analysis into sections
-    sections = analysis.split("\n\n")
     current_section = None
     current_regulation = None
     
-    for section in sections:
-        lines = section.strip().split("\n")
-        for line in lines:
-            line = line.strip()
+    for line in analysis.splitlines():
+        line = line.strip()
+        
+        # Skip empty lines
+        if not line:
+            continue
             
-            # Skip empty lines
-            if not line:
-                continue
-                
-            # Check for section headers
-            if "Technical Requirements:" in line or "Technical Implementation:" in line:
-                current_section = "technical"
-                continue
-            elif "Next Steps:" in line or "Recommended Steps:" in line:
-                current_section = "steps"
-                continue
+        # Check for section headers
+        if _TECH_HDR_RE.search(line):
+            current_section = "technical"
+            continue
+        elif _STEPS_HDR_RE.search(line):
+            current_section = "steps"
+            continue
+        
+        # Process regulations
+        if _REG_RE.search(line):
+            # Start a new regulation entry
+            if current_regulation:
+                result["regulations"].append(current_regulation)
             
-            # Process regulations
-            if any(reg in line for reg in ["GDPR", "CCPA", "HIPAA", "PCI DSS", "SOC 2", "ISO"]):
-                # Start a new regulation entry
-                if current_regulation:
-                    result["regulations"].append(current_regulation)
-                
-                # Initialize new regulation
-                current_regulation = {
-                    "name": line.split(":")[0].strip(),
-                    "relevance": "",
-                    "requirements": [],
-                    "priority": determine_priority(line)
-                }
-                
-                # Add description if present
-                if ":" in line:
-                    current_regulation["relevance"] = line.split(":", 1)[1].strip()
-                
-                continue
+            # Initialize new regulation
+            current_regulation = {
+                "name": line.split(":")[0].strip(),
+                "relevance": "",
+                "requirements": [],
+                "priority": determine_priority(line)
+            }
             
-            # Add items to appropriate sections
-            if current_section == "technical" and line.strip("- "):
-                result["technicalRequirements"].append(line.strip("- "))
-            elif current_section == "steps" and line.strip("- "):
-                result["nextSteps"].append(line.strip("- "))
-            elif current_regulation and line.strip("- "):
-                if not current_regulation["relevance"] and ":" in line:
-                    current_regulation["relevance"] = line.split(":", 1)[1].strip()
-                else:
-                    current_regulation["requirements"].append(line.strip("- "))
+            # Add description if present
+            if ":" in line:
+                current_regulation["relevance"] = line.split(":", 1)[1].strip()
+            
+            continue
+        
+        # Add items to appropriate sections
+        if current_section == "technical" and line.strip("- "):
+            result["technicalRequirements"].append(line.strip("- "))
+        elif current_section == "steps" and line.strip("- "):
+            result["nextSteps"].append(line.strip("- "))
+        elif current_regulation and line.strip("- "):
+            if not current_regulation["relevance"] and ":" in line:
+                current_regulation["relevance"] = line.split(":", 1)[1].strip()
+            else:
+                current_regulation["requirements"].append(line.strip("- "))
     
     # Add the last regulation if exists
     if current_regulation:
@@ -425,15 +748,34 @@ def parse_compliance_analysis(analysis: str) -> Dict[str, Any]:
 
 def determine_priority(text: str) -> str:
     """Determine priority level from text."""
-    text_lower = text.lower()
-    if any(word in text_lower for word in ["critical", "high priority", "urgent", "immediate"]):
+    if _PRIO_HIGH_RE.search(text):
         return "high"
-    elif any(word in text_lower for word in ["moderate", "medium priority", "important"]):
+    elif _PRIO_MED_RE.search(text):
         return "medium"
     return "low"
 
+@tavily_breaker
+async def request_tavily_search(client: httpx.AsyncClient, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a Tavily search and return the decoded response."""
+    response = await client.post(
+        "https://api.tavily.com/search",
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {TAVILY_API_KEY}"
+        },
+        json=payload
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail="Failed to fetch policy information"
+        )
+    
+    return response.json()
+
 @app.post("/api/search-policies")
-async def search_policies(request: PolicySearchRequest):
+async def search_policies(request: PolicySearchRequest, http_request: Request):
     """Search for relevant policy documents from specified domains."""
     if not TAVILY_API_KEY:
         raise HTTPException(
@@ -442,151 +784,137 @@ async def search_policies(request: PolicySearchRequest):
         )
 
     try:
-        # Build domain-specific query parts
-        domain_queries = []
-        for domain in request.domains:
-            if domain.startswith("."):
-                domain_queries.append(f"site:{domain[1:]}")
-            else:
-                domain_queries.append(f"site:.{domain}")
+        # Tavily filters by domain itself, so the query stays as the user wrote it
+        include_domains = [domain.lstrip(".") for domain in request.domains]
+
+        client = http_request.app.state.tavily_client
+        payload = {
+            "query": request.query,
+            "search_depth": "advanced",
+            "max_results": 10,
+            "filter_language": "en",
+            "include_answer": False,
+            "include_raw_content": False,
+            "include_domains": include_domains,
+            "exclude_domains": [],
+            "search_type": "keyword"
+        }
+        data = await cached_call(
+            tavily_cache,
+            make_cache_key("search-policies", request.query, *request.domains),
+            lambda: request_tavily_search(client, payload)
+        )
         
-        domain_filter = " OR ".join(domain_queries)
-        search_query = f"({request.query}) ({domain_filter})"
-
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                "https://api.tavily.com/search",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {TAVILY_API_KEY}"
-                },
-                json={
-                    "query": search_query,
-                    "search_depth": "advanced",
-                    "max_results": 10,
-                    "filter_language": "en",
-                    "include_answer": False,
-                    "include_raw_content": False,
-                    "include_domains": request.domains,
-                    "exclude_domains": [],
-                    "search_type": "keyword"
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Failed to fetch policy information"
-                )
-            
-            data = response.json()
-            
-            # Extract and format relevant results
-            results = []
-            seen_urls = set()  # To prevent duplicate results
-            
-            for result in data.get("results", []):
-                url = result.get("url")
-                if url and url not in seen_urls and result.get("title"):
-                    seen_urls.add(url)
-                    domain = extract_domain(url)
-                    category = categorize_domain(domain, request.domains)
-                    
-                    results.append({
-                        "title": result["title"],
-                        "url": url,
-                        "snippet": result.get("snippet", ""),
-                        "relevance_score": result.get("score", 0),
-                        "domain": domain,
-                        "category": category
-                    })
-            
-            # Sort by relevance score
-            results.sort(key=lambda x: x["relevance_score"], reverse=True)
-            
-            return {
-                "policies": results,
-                "query": request.query,
-                "domains": request.domains
-            }
+        # Deduplicate by URL, dropping results without a URL or title
+        unique_results = {
+            result["url"]: result
+            for result in data.get("results", [])
+            if result.get("url") and result.get("title")
+        }
+        
+        # Extract and format relevant results
+        results = []
+        for url, result in unique_results.items():
+            domain = extract_domain(url)
+            results.append({
+                "title": result["title"],
+                "url": url,
+                "snippet": result.get("snippet", ""),
+                "relevance_score": result.get("score", 0),
+                "domain": domain,
+                "category": categorize_domain(domain, request.domains)
+            })
+        
+        # Sort by relevance score
+        results.sort(key=lambda x: x["relevance_score"], reverse=True)
+        
+        return {
+            "policies": results,
+            "query": request.query,
+            "domains": request.domains
+        }
 
     except httpx.TimeoutException:
         raise HTTPException(
             status_code=504,
             detail="Request timed out while searching for policies"
         )
+    except CircuitBreakerError:
+        raise HTTPException(
+            status_code=503,
+            detail="Policy search is temporarily unavailable. Please try again later."
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to search for policies: {str(e)}"
         )
 
+@lru_cache(maxsize=4096)
 def extract_domain(url: str) -> str:
     """Extract the main domain from a URL."""
     try:
-        from urllib.parse import urlparse
-        parsed = urlparse(url)
-        return parsed.netloc
-    except:
+        return urlsplit(url).netloc
+    except ValueError:
         return url
 
 def categorize_domain(domain: str, search_domains: List[str]) -> str:
     """Categorize a domain based on the search domains."""
-    domain_lower = domain.lower()
+    domain_lower = domain.lower().split(":", 1)[0]
+    labels = domain_lower.split(".")
     
-    if any(d in domain_lower for d in ["europa.eu", "ec.europa.eu", "edpb.europa.eu"]):
+    if labels[-2:] == ["europa", "eu"]:
         return "EU Domain"
-    elif any(d in domain_lower for d in ["gov", "government"]):
+    elif not _GOV_LABELS.isdisjoint(labels):
         return "Government Domain"
-    elif any(d in domain_lower for d in ["int", "un.org", "who.int"]):
+    elif not _INTL_LABELS.isdisjoint(labels) or ".".join(labels[-2:]) in _INTL_DOMAINS:
         return "International Organization"
     elif domain_lower.endswith(".org"):
         return "Non-Profit Organization"
     else:
         return "Other"
 
-def analyze_traffic_data(data: List[float]) -> SentinelResponse:
-    """Analyze traffic data using the random forest model."""
+def classify_prediction(prediction: Any) -> SentinelResponse:
+    """Map a raw model prediction to a response."""
+    if prediction == 0:  # Normal traffic
+        return SentinelResponse(
+            status="clean",
+            message="No threats detected in the traffic data.",
+            type=None
+        )
+    
+    # Updated attack type mapping based on common network attack categories
+    attack_types = {
+        1: "DoS Attack",  # Denial of Service
+        2: "Probe Attack",  # Network Probe/Port Scan
+        3: "Remote Access Attack",  # Remote-to-Local
+        4: "Privilege Escalation Attack",  # User-to-Root
+        5: "Data Exfiltration Attack",
+        6: "Brute Force Attack",
+        7: "Man-in-the-Middle Attack"
+    }
+    
+    attack_type = attack_types.get(prediction, f"Unknown Attack (Type {prediction})")
+    message = get_attack_description(attack_type)
+    
+    return SentinelResponse(
+        status="malicious",
+        message=message,
+        type=attack_type
+    )
+
+def analyze_traffic_data(data: np.ndarray) -> List[SentinelResponse]:
+    """Analyze rows of traffic data using the random forest model."""
     try:
-        # Define the column names as per model's training data
-        columns = ['sbytes', 'rate', 'sttl', 'dttl', 'sload', 'dload', 'smean', 'ct_state_ttl', 'ct_dst_src_ltm', 'ct_srv_dst']
-        
-        # Convert input to DataFrame
-        input_df = pd.DataFrame([data], columns=columns)
+        # All rows are predicted in a single call
+        predictions = predict_traffic(data)
+        logger.debug("Raw prediction values: %s", predictions)
         
-        # Make prediction
-        prediction = rf_model.predict(input_df)[0]
-        print(f"Debug - Raw prediction value: {prediction}")  # Debug log
-        
-        # Map prediction to response
-        if prediction == 0:  # Normal traffic
-            return SentinelResponse(
-                status="clean",
-                message="No threats detected in the traffic data.",
-                type=None
-            )
-        else:
-            # Updated attack type mapping based on common network attack categories
-            attack_types = {
-                1: "DoS Attack",  # Denial of Service
-                2: "Probe Attack",  # Network Probe/Port Scan
-                3: "Remote Access Attack",  # Remote-to-Local
-                4: "Privilege Escalation Attack",  # User-to-Root
-                5: "Data Exfiltration Attack",
-                6: "Brute Force Attack",
-                7: "Man-in-the-Middle Attack"
-            }
-            
-            attack_type = attack_types.get(prediction, f"Unknown Attack (Type {prediction})")
-            message = get_attack_description(attack_type)
-            
-            return SentinelResponse(
-                status="malicious",
-                message=message,
-                type=attack_type
-            )
+        # Only build one response per distinct prediction
+        responses = {prediction: classify_prediction(prediction) for prediction in set(predictions)}
+        return [responses[prediction] for prediction in predictions]
     except Exception as e:
-        print(f"Debug - Error in analysis: {str(e)}")  # Debug log
+        logger.exception("Error in traffic analysis")
         raise HTTPException(
             status_code=500,
             detail=f"Error analyzing traffic data: {str(e)}"
@@ -612,51 +940,64 @@ async def analyze_traffic(
 ):
     """Endpoint to analyze network traffic data for security threats."""
     
-    # Check file size (5MB limit for example)
-    if file.size > 5 * 1024 * 1024:
+    # Check file size
+    if file.size is not None and file.size > MAX_TRAFFIC_FILE_SIZE:
         raise HTTPException(
             status_code=400,
-            detail="File size too large. Please upload a file smaller than 5MB."
+            detail="File size too large. Please upload a file smaller than 2MB."
         )
     
     # Rate limiting (1 upload per minute per user/IP)
-    client_id = username or "anonymous"
-    current_time = datetime.now()
+    client_id = hashlib.blake2b((username or "anonymous").encode(), digest_size=16).digest()
     
     if client_id in upload_history:
-        last_upload = upload_history[client_id]
-        if current_time - last_upload < timedelta(minutes=1):
-            raise HTTPException(
-                status_code=429,
-                detail="Please wait a minute before uploading another file."
-            )
+        raise HTTPException(
+            status_code=429,
+            detail="Please wait a minute before uploading another file."
+        )
     
-    upload_history[client_id] = current_time
+    upload_history[client_id] = True
     
     try:
-        # Read file content
-        content = await file.read()
+        # Read file content, never more than a batch can legitimately need
+        content = await file.read(MAX_TRAFFIC_FILE_SIZE)
+        if await file.read(1):
+            raise HTTPException(
+                status_code=400,
+                detail="File size too large. Please upload a file smaller than 2MB."
+            )
         
         try:
             # Try to parse as JSON
-            data = json.loads(content)
-            if not isinstance(data, list) or len(data) != 10:
+            data = orjson.loads(content)
+            
+            # Either {"rows": [[...], ...]} for a batch or a single bare row
+            is_batch = isinstance(data, dict)
+            rows = data.get("rows") if is_batch else [data]
+            if not isinstance(rows, list) or not 0 < len(rows) <= MAX_TRAFFIC_BATCH_ROWS:
                 raise ValueError("Invalid data format")
             
             # Convert all values to float
-            traffic_data = [float(x) for x in data]
+            traffic_data = np.asarray(rows, dtype=np.float32)
+            if traffic_data.ndim != 2 or traffic_data.shape[1] != len(TRAFFIC_FEATURES):
+                raise ValueError("Invalid data format")
+            # Values outside the float32 range silently become inf
+            if not np.isfinite(traffic_data).all():
+                raise ValueError("Invalid data format")
             
-        except (json.JSONDecodeError, ValueError):
+        except (ValueError, TypeError):
             raise HTTPException(
                 status_code=400,
                 detail="Invalid file format. Please upload a JSON file with the correct traffic data format."
             )
         
-        # Analyze the traffic data
-        result = analyze_traffic_data(traffic_data)
+        # Analyze the traffic data off the event loop
+        results = await run_in_threadpool(analyze_traffic_data, traffic_data)
         
-        return result
+        return results if is_batch else results[0]
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
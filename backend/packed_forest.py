@@ -0,0 +1,126 @@
+"""Flat structure-of-arrays form of the traffic RandomForest.
+
+Every tree in the forest is laid end to end in a handful of contiguous arrays:
+
+- ``feature``: uint8 feature index per node, ``LEAF`` for leaf nodes
+- ``threshold``: float32 split threshold per node
+- ``left`` / ``right``: int32 global child indices; for a leaf, ``left`` holds
+  its row in ``leaf_proba`` instead
+- ``leaf_proba``: float32 class probabilities, one row per leaf
+- ``roots``: int32 index of each tree's root node
+- ``n_features``: number of input features the forest was fit on
+- ``feature_names``: the model's ``feature_names_in_``, when it was fit with them
+
+The tree walk only touches a few bytes per node, which keeps single-row
+inference cache friendly.
+"""
+from typing import Dict
+
+import numba
+import numpy as np
+
+LEAF = 255  # Feature marker for leaf nodes
+
+def _float32_floor(values: np.ndarray) -> np.ndarray:
+    """Round float64 thresholds down to float32.
+    
+    sklearn compares float32 inputs against float64 thresholds. Rounding a
+    threshold down to the largest float32 not above it keeps ``x <= threshold``
+    true for exactly the same float32 inputs, where round-to-nearest could
+    send inputs equal to a rounded-up threshold the wrong way.
+    """
+    rounded = values.astype(np.float32)
+    return np.where(rounded > values, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+def pack_forest(rf_model) -> Dict[str, np.ndarray]:
+    """Flatten a fitted sklearn RandomForestClassifier into packed arrays."""
+    if rf_model.n_features_in_ >= LEAF:
+        raise ValueError("Packed forests support at most 254 features")
+
+    roots, feature, threshold, left, right, leaf_proba = [], [], [], [], [], []
+    node_offset = 0
+    leaf_offset = 0
+
+    for estimator in rf_model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        leaf_rows = np.cumsum(is_leaf) - 1 + leaf_offset
+
+        value = tree.value[:, 0, :]
+        proba = value / value.sum(axis=1, keepdims=True)
+
+        roots.append(node_offset)
+        feature.append(np.where(is_leaf, LEAF, tree.feature).astype(np.uint8))
+        threshold.append(_float32_floor(tree.threshold))
+        left.append(np.where(is_leaf, leaf_rows, tree.children_left + node_offset).astype(np.int32))
+        right.append(np.where(is_leaf, -1, tree.children_right + node_offset).astype(np.int32))
+        leaf_proba.append(proba[is_leaf].astype(np.float32))
+
+        node_offset += tree.node_count
+        leaf_offset += int(is_leaf.sum())
+
+    classes = np.asarray(rf_model.classes_)
+    if classes.dtype == object:
+        classes = classes.astype(str)
+
+    arrays = {
+        "n_features": np.asarray(rf_model.n_features_in_, dtype=np.int32),
+        "roots": np.asarray(roots, dtype=np.int32),
+        "feature": np.concatenate(feature),
+        "threshold": np.concatenate(threshold),
+        "left": np.concatenate(left),
+        "right": np.concatenate(right),
+        "leaf_proba": np.concatenate(leaf_proba),
+        "classes": classes
+    }
+    if hasattr(rf_model, "feature_names_in_"):
+        arrays["feature_names"] = np.asarray(rf_model.feature_names_in_, dtype=str)
+    return arrays
+
+@numba.njit(cache=True)
+def _predict_proba(X, roots, feature, threshold, left, right, leaf_proba):
+    proba = np.zeros((X.shape[0], leaf_proba.shape[1]), dtype=np.float32)
+    for row in range(X.shape[0]):
+        for root in roots:
+            node = root
+            while feature[node] != LEAF:
+                if X[row, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            proba[row] += leaf_proba[left[node]]
+    return proba
+
+class PackedForest:
+    """Predict with a forest produced by pack_forest."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.n_features = int(arrays["n_features"])
+        self.feature_names = arrays["feature_names"].tolist() if "feature_names" in arrays else None
+        self.roots = arrays["roots"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.leaf_proba = arrays["leaf_proba"]
+        self.classes = arrays["classes"]
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        # The njit walk doesn't bounds-check feature indices
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected rows of {self.n_features} features, got shape {X.shape}")
+        proba = _predict_proba(
+            np.ascontiguousarray(X, dtype=np.float32),
+            self.roots,
+            self.feature,
+            self.threshold,
+            self.left,
+            self.right,
+            self.leaf_proba
+        )
+        return self.classes[np.argmax(proba, axis=1)]
+
+def load_packed_forest(path: str) -> PackedForest:
+    """Load a forest saved with np.savez from pack_forest's output."""
+    with np.load(path) as data:
+        return PackedForest({name: data[name] for name in data.files})